@@ -5,50 +5,147 @@ import opik
 from opik import id_helpers
 import os
 import json
+import sys
 import time
 
+# orjson is optional; it parses the data files noticeably faster than the stdlib
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 PROJECT_NAME = os.getenv("PROJECT_NAME", "CRM-Chatbot-Agent-Opik")
 
+# Only keep keys that span() accepts
+ALLOWED_SPAN_KEYS = frozenset({
+    "id",
+    "parent_span_id",
+    "name",
+    "type",
+    "start_time",
+    "end_time",
+    "metadata",
+    "input",
+    "output",
+    "tags",
+    "usage",
+    "model",
+    "provider",
+    "error_info",
+    "total_cost",
+    "attachments",
+})
+
+# Trace fields left out of the trace() payload template: fields that shouldn't be
+# sent or would conflict, plus the fields set per upload. Private `_`-prefixed
+# keys cached at load time are always left out too.
+TRACE_EXCLUDED_KEYS = frozenset({
+    "feedback_scores",
+    "duration",
+    "project_id",
+    "span_count",
+    "llm_span_count",
+    "id",
+    "start_time",
+    "end_time",
+    "thread_id",
+    "project_name",
+})
+
 # Uses the config from opik.configure() (API key + workspace from ~/.opik.config)
 client = opik.Opik()
 
+# Python 3.11+ fromisoformat accepts a trailing 'Z' natively
+_FROMISO_HANDLES_Z = sys.version_info >= (3, 11)
+
+# Sort key for traces without a start time
+_MIN_UTC_DATETIME = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
 def load_traces():
-    """Load traces from local JSON file."""
+    """
+    Load traces from local JSON file.
+
+    Values that don't depend on the upload day are computed here once per trace and cached
+    on the dict: the trace() payload minus the per-upload fields (`_template`), parsed
+    times (`_start_dt`/`_end_dt`), the scale factor (`_scale`) and the desired duration
+    as a timedelta (`_duration`).
+    """
     output_file = "workshop_traces_data.json"
-    with open(output_file, 'r') as f:
-        loaded_traces = json.load(f)
+    with open(output_file, 'rb') as f:
+        loaded_traces = _json_loads(f.read())
+    for trace in loaded_traces:
+        trace['_template'] = {
+            k: v for k, v in trace.items()
+            if k not in TRACE_EXCLUDED_KEYS and not k.startswith('_')
+        }
+        attach_parsed_times(trace)
+        trace['_scale'] = compute_scale_factor(trace)
+        # The desired trace duration comes from the duration field (ms)
+        trace['_duration'] = datetime.timedelta(milliseconds=trace.get('duration', 2500))
     return loaded_traces
 
 
-def load_spans():
-    """Load spans from local JSON file."""
+def load_spans(traces):
+    """
+    Load spans from local JSON file.
+
+    Each span's start/end offsets from its parent trace's original start, already multiplied
+    by the trace's scale factor, are precomputed as `_start_offset`/`_end_offset` timedeltas.
+    They are the same for every day the trace is uploaded; only the day's start time varies.
+    """
     output_file = "workshop_spans_data.json"
-    with open(output_file, 'r') as f:
-        loaded_spans = json.load(f)
+    with open(output_file, 'rb') as f:
+        loaded_spans = _json_loads(f.read())
+    traces_by_id = {trace['id']: trace for trace in traces}
+    for span in loaded_spans:
+        attach_parsed_times(span)
+        trace = traces_by_id.get(span.get('trace_id'))
+        trace_start = trace['_start_dt'] if trace else None
+        span_start = span['_start_dt']
+        span_end = span['_end_dt']
+        if trace_start is None:
+            # No reference point: pin the span to the start/end of its new trace
+            span['_start_offset'] = datetime.timedelta(0)
+            span['_end_offset'] = None
+            continue
+        # Scale the offsets to fit within the trace's desired duration. A span without a
+        # parsable start is placed at the trace start; one without a parsable end is given
+        # the trace's end (signalled by None)
+        scale = trace['_scale']
+        span['_start_offset'] = (span_start - trace_start) * scale if span_start else datetime.timedelta(0)
+        span['_end_offset'] = (span_end - trace_start) * scale if span_end else None
     return loaded_spans
 
 
-def safe_thread_id(trace):
-    """Safely get thread_id from trace dict."""
-    try:
-        return trace.get('thread_id')
-    except (KeyError, AttributeError):
-        return None
-
-
 def parse_datetime(dt_str_or_obj):
     """Parse datetime from string or return datetime object."""
     if isinstance(dt_str_or_obj, str):
+        if not _FROMISO_HANDLES_Z:
+            dt_str_or_obj = dt_str_or_obj.replace('Z', '+00:00')
         try:
-            dt_str = dt_str_or_obj.replace('Z', '+00:00').replace(' ', 'T')
-            return datetime.datetime.fromisoformat(dt_str)
-        except:
+            return datetime.datetime.fromisoformat(dt_str_or_obj)
+        except ValueError:
             return None
     elif isinstance(dt_str_or_obj, datetime.datetime):
         return dt_str_or_obj
     return None
 
 
+def parse_utc_datetime(dt_str_or_obj):
+    """Parse datetime like parse_datetime, assuming UTC when no timezone is given."""
+    dt = parse_datetime(dt_str_or_obj)
+    if dt is not None and dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
+
+
+def attach_parsed_times(record):
+    """Parse a trace/span's start_time and end_time into UTC `_start_dt`/`_end_dt` keys."""
+    record['_start_dt'] = parse_utc_datetime(record.get('start_time'))
+    record['_end_dt'] = parse_utc_datetime(record.get('end_time'))
+
+
 def compute_scale_factor(trace):
     """
     Compute the scale factor to compress span offsets into the trace's intended duration.
@@ -56,19 +153,16 @@ def compute_scale_factor(trace):
     The trace JSON has a `duration` field (in ms) representing the desired realistic duration,
     but the start_time/end_time timestamps (which spans are aligned to) often span a much
     wider range. This function returns the ratio to compress span offsets proportionally.
+    Expects a trace already prepared by attach_parsed_times().
     """
-    original_start = parse_datetime(trace.get('start_time'))
-    original_end = parse_datetime(trace.get('end_time'))
+    # Both are UTC-aware: attach_parsed_times() normalizes them at load
+    original_start = trace['_start_dt']
+    original_end = trace['_end_dt']
     duration_ms = trace.get('duration', 0)
     
     if not original_start or not original_end or not duration_ms:
         return 1.0
     
-    if original_start.tzinfo is None:
-        original_start = original_start.replace(tzinfo=datetime.timezone.utc)
-    if original_end.tzinfo is None:
-        original_end = original_end.replace(tzinfo=datetime.timezone.utc)
-    
     original_span_seconds = (original_end - original_start).total_seconds()
     desired_seconds = duration_ms / 1000.0
     
@@ -78,7 +172,7 @@ def compute_scale_factor(trace):
     return desired_seconds / original_span_seconds
 
 
-def upload_traces_for_day(traces, spans, day_offset, threads_per_day, global_thread_id_map):
+def upload_traces_for_day(traces_by_thread, spans_by_trace, day_offset, threads_per_day, global_thread_id_map):
     """Upload traces and spans for a specific day (day_offset days ago)."""
     # Backdate to day_offset days ago, using UTC timezone
     day_start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=day_offset)
@@ -95,44 +189,31 @@ def upload_traces_for_day(traces, spans, day_offset, threads_per_day, global_thr
         print(f"No threads assigned for day {day_offset}, skipping...")
         return 0, 0
     
-    # Group traces by thread_id
-    traces_by_thread = {}
-    for trace in traces:
-        thread_id = safe_thread_id(trace)
-        if thread_id and thread_id in threads_for_day:
-            if thread_id not in traces_by_thread:
-                traces_by_thread[thread_id] = []
-            traces_by_thread[thread_id].append(trace)
-    
     traces_created = 0
     spans_created = 0
     
+    # Bind names used per span to locals to skip global/attribute lookups in the loops
+    generate_id = id_helpers.generate_id
+    allowed_span_keys = ALLOWED_SPAN_KEYS
+    
     # Process all traces for each thread assigned to this day
     for thread_id in threads_for_day:
         if thread_id not in traces_by_thread:
             continue
             
-        thread_traces = traces_by_thread[thread_id]
         # Get the day-specific thread_id for this (thread_id, day) combination
         new_thread_id = global_thread_id_map.get((thread_id, day_offset))
         if not new_thread_id:
             continue
         
-        # Sort traces by their original start_time to maintain order within thread
-        thread_traces.sort(key=lambda t: parse_datetime(t.get('start_time')) or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc))
+        # Already sorted by original start_time in main(), maintaining order within thread
+        thread_traces = traces_by_thread[thread_id]
         
         # Start with a random offset within the day (0-4 hours) to spread threads out
         base_time = day + datetime.timedelta(seconds=random.randint(0, 14400))
         
         for idx, trace in enumerate(thread_traces):
-            trace_data_i = trace.copy()
-            save_id = trace_data_i['id']
-            
-            # Compute scale factor: compresses span offsets to fit within intended duration
-            scale = compute_scale_factor(trace)
-            
-            # The desired trace duration comes from the duration field (ms -> seconds)
-            desired_duration_s = trace_data_i.get('duration', 2500) / 1000.0
+            save_id = trace['id']
             
             # For subsequent traces in the same thread, add a small delay (30s to 3 min)
             if idx > 0:
@@ -140,40 +221,27 @@ def upload_traces_for_day(traces, spans, day_offset, threads_per_day, global_thr
                 base_time = base_time + datetime.timedelta(seconds=delay_seconds)
             
             start_time = base_time
-            end_time = start_time + datetime.timedelta(seconds=desired_duration_s)
+            end_time = start_time + trace['_duration']
             
             # Move base_time past this trace for the next one
             base_time = end_time
             
             # Generate trace ID with the backdated timestamp using id_helpers
-            trace_id = id_helpers.generate_id(timestamp=start_time)
-            
-            # Prepare trace data
-            trace_data_i['id'] = trace_id
-            trace_data_i['start_time'] = start_time
-            trace_data_i['end_time'] = end_time
-            trace_data_i['thread_id'] = new_thread_id
-            
-            # Remove fields that shouldn't be sent or would conflict
-            for key_to_remove in ['feedback_scores', 'duration', 'project_id',
-                                  'span_count', 'llm_span_count']:
-                trace_data_i.pop(key_to_remove, None)
+            trace_id = generate_id(timestamp=start_time)
             
-            trace_data_i['project_name'] = PROJECT_NAME
-            
-            # Create the trace
-            trace_obj = client.trace(**trace_data_i)
+            # Create the trace from the load-time template plus this upload's fields
+            trace_obj = client.trace(
+                **trace['_template'],
+                id=trace_id,
+                start_time=start_time,
+                end_time=end_time,
+                thread_id=new_thread_id,
+                project_name=PROJECT_NAME,
+            )
             traces_created += 1
             
-            # Get spans for this trace from the loaded spans list
-            trace_spans_list = [span for span in spans if span.get('trace_id') == save_id]
-            
-            # Compute original trace start for offset calculation
-            original_trace_start = parse_datetime(trace.get('start_time'))
-            if original_trace_start is None:
-                original_trace_start = start_time
-            elif original_trace_start.tzinfo is None:
-                original_trace_start = original_trace_start.replace(tzinfo=datetime.timezone.utc)
+            # Get spans for this trace from the trace_id index built in main()
+            trace_spans_list = spans_by_trace.get(save_id, ())
             
             # Generate replacement span IDs using id_helpers with SCALED timestamps
             span_replacement_ids = {}
@@ -182,81 +250,40 @@ def upload_traces_for_day(traces, spans, day_offset, threads_per_day, global_thr
                 if not span_id:
                     continue
                 
-                span_start_time = parse_datetime(span.get('start_time'))
-                if span_start_time is None:
-                    span_start_time = original_trace_start
-                elif span_start_time.tzinfo is None:
-                    span_start_time = span_start_time.replace(tzinfo=datetime.timezone.utc)
+                # The precomputed offset is already scaled to fit within desired duration
+                adjusted_span_start = start_time + span['_start_offset']
                 
-                # Scale the offset to fit within desired duration
-                raw_offset = (span_start_time - original_trace_start).total_seconds()
-                scaled_offset = raw_offset * scale
-                adjusted_span_start = start_time + datetime.timedelta(seconds=scaled_offset)
-                
-                span_replacement_ids[span_id] = id_helpers.generate_id(timestamp=adjusted_span_start)
+                span_replacement_ids[span_id] = generate_id(timestamp=adjusted_span_start)
+            
+            get_replacement_id = span_replacement_ids.get
             
             # Create spans for the trace
             for span in trace_spans_list:
-                span_dict = span.copy()
-                span_id = span_dict.get('id')
+                span_id = span.get('id')
                 if not span_id:
                     continue
                 
-                span_dict['id'] = span_replacement_ids.get(span_id)
-                span_dict['parent_span_id'] = span_replacement_ids.get(span_dict.get('parent_span_id'))
+                # Only keep keys that span() accepts. This drops duration too,
+                # letting Opik calculate it from the timestamps.
+                span_dict = {k: v for k, v in span.items() if k in allowed_span_keys}
+                
+                span_dict['id'] = get_replacement_id(span_id)
+                span_dict['parent_span_id'] = get_replacement_id(span.get('parent_span_id'))
                 
                 # Adjust span start_time: scale offset to fit within trace duration
-                if 'start_time' in span_dict and span_dict['start_time']:
-                    original_start = parse_datetime(span_dict['start_time'])
-                    if original_start and isinstance(original_start, datetime.datetime):
-                        if original_start.tzinfo is None:
-                            original_start = original_start.replace(tzinfo=datetime.timezone.utc)
-                        raw_offset = (original_start - original_trace_start).total_seconds()
-                        scaled_offset = raw_offset * scale
-                        span_dict['start_time'] = start_time + datetime.timedelta(seconds=scaled_offset)
-                    else:
-                        span_dict['start_time'] = start_time
+                if span_dict.get('start_time'):
+                    span_dict['start_time'] = start_time + span['_start_offset']
                 
                 # Adjust span end_time: scale offset to fit within trace duration
-                if 'end_time' in span_dict and span_dict['end_time']:
-                    original_end = parse_datetime(span_dict['end_time'])
-                    if original_end and isinstance(original_end, datetime.datetime):
-                        if original_end.tzinfo is None:
-                            original_end = original_end.replace(tzinfo=datetime.timezone.utc)
-                        raw_offset = (original_end - original_trace_start).total_seconds()
-                        scaled_offset = raw_offset * scale
-                        span_dict['end_time'] = start_time + datetime.timedelta(seconds=scaled_offset)
+                if span_dict.get('end_time'):
+                    end_offset = span['_end_offset']
+                    if end_offset is not None:
+                        span_dict['end_time'] = start_time + end_offset
                     else:
                         span_dict['end_time'] = end_time
                 
-                # Remove duration from spans too - let Opik calculate from timestamps
-                if 'duration' in span_dict:
-                    del span_dict['duration']
-                
-                # Only keep keys that span() accepts
-                allowed_keys = {
-                    "id",
-                    "parent_span_id",
-                    "name",
-                    "type",
-                    "start_time",
-                    "end_time",
-                    "metadata",
-                    "input",
-                    "output",
-                    "tags",
-                    "usage",
-                    "model",
-                    "provider",
-                    "error_info",
-                    "total_cost",
-                    "attachments"
-                }
-                
-                filtered_span_dict = {k: v for k, v in span_dict.items() if k in allowed_keys}
-                
                 try:
-                    trace_obj.span(**filtered_span_dict)
+                    trace_obj.span(**span_dict)
                     spans_created += 1
                 except Exception as e:
                     print(f"Error creating span {span_id}: {e}")
@@ -273,18 +300,27 @@ def main():
     """Main function to upload traces for the last month."""
     print("Loading traces and spans from JSON files...")
     traces = load_traces()
-    spans = load_spans()
+    spans = load_spans(traces)
     print(f"Loaded {len(traces)} traces and {len(spans)} spans")
     
+    # Index spans by trace_id so each trace's spans can be looked up directly
+    spans_by_trace = {}
+    for span in spans:
+        spans_by_trace.setdefault(span.get('trace_id'), []).append(span)
+    
     # Group traces by thread_id
     traces_by_thread = {}
     for trace in traces:
-        thread_id = safe_thread_id(trace)
+        thread_id = trace.get('thread_id')
         if thread_id:
             if thread_id not in traces_by_thread:
                 traces_by_thread[thread_id] = []
             traces_by_thread[thread_id].append(trace)
     
+    # Sort traces by their original start_time once, so every day can replay them in order
+    for thread_traces in traces_by_thread.values():
+        thread_traces.sort(key=lambda t: t['_start_dt'] or _MIN_UTC_DATETIME)
+    
     unique_thread_ids = list(traces_by_thread.keys())
     print(f"Found {len(unique_thread_ids)} unique threads")
     
@@ -299,11 +335,14 @@ def main():
         sample_size = random.randint(min_threads, max_threads)
         sampled_threads = random.sample(unique_thread_ids, sample_size)
         threads_per_day[day] = sampled_threads
-        
-        for thread_id in sampled_threads:
-            key = (thread_id, day)
-            if key not in global_thread_id_map:
-                global_thread_id_map[key] = str(uuid.uuid4())
+    
+    # Generate a random UUID4 per (thread_id, day), reading the random bytes for
+    # all of them in one os.urandom() call instead of one per uuid.uuid4()
+    thread_keys = [(thread_id, day) for day, sampled_threads in threads_per_day.items()
+                   for thread_id in sampled_threads]
+    random_bytes = os.urandom(16 * len(thread_keys))
+    for n, key in enumerate(thread_keys):
+        global_thread_id_map[key] = str(uuid.UUID(bytes=random_bytes[16 * n:16 * (n + 1)], version=4))
     
     # Generate traces for the last month (30 days)
     total_traces = 0
@@ -314,7 +353,7 @@ def main():
     for i in range(1, 31):
         try:
             traces_count, spans_count = upload_traces_for_day(
-                traces, spans, i, threads_per_day, global_thread_id_map
+                traces_by_thread, spans_by_trace, i, threads_per_day, global_thread_id_map
             )
             total_traces += traces_count
             total_spans += spans_count
@@ -322,11 +361,12 @@ def main():
             print(f"Error processing day {i}: {e}")
             import traceback
             traceback.print_exc()
-            # Short pause on error, then continue
-            time.sleep(2)
     
-    # Final flush to ensure all data is sent
-    time.sleep(2)
+    # Final flush: trace()/span() calls are queued and sent in batches by the
+    # client's background streamer (which retries failed requests), so wait for
+    # the queue to drain
+    if not client.flush():
+        print("Warning: not all traces and spans were sent before the flush finished")
     
     elapsed = time.time() - start
     print(f"\nFinished logging traces for the last month in {elapsed:.1f}s!")